@@ -1,25 +1,83 @@
 import os
 import csv
-import shutil
+import errno
+import locale
+import stat
+import threading
+import heapq
 from collections import defaultdict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# ioctl request number for cloning a file's extents (Linux, btrfs/XFS)
+FICLONE = 0x40049409
+LINK_MODES = ('hardlink', 'reflink', 'copy')
+# copy_file_range errors that mean "not possible here" rather than a real I/O failure
+COPY_FILE_RANGE_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+COPY_BUFFER_SIZE = 1 << 20
+# One reusable copy buffer per worker thread
+_copy_buffers = threading.local()
+# Label files up to this size are read into memory at once; larger ones are streamed
+MAX_IN_MEMORY_CSV_SIZE = 512 * 1024 * 1024
+
+
+def stream_label_rows(csv_path, encoding=None):
+    """
+    Reads the image name and emotion columns of a labels CSV file row by row with csv.reader,
+    which handles quoted fields and does not hold the whole file in memory.
+    Returns them as two parallel lists.
+    """
+    image_names = []
+    emotions = []
+    with open(csv_path, 'r', newline='', encoding=encoding) as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)  # Skip header row if present
+        for row in reader:
+            image_names.append(row[1])
+            emotions.append(row[2])
+    # Handle case sensitivity of the emotion labels in a single pass over the column
+    return image_names, [emotion.strip().lower() for emotion in emotions]
+
+
+def read_label_rows(csv_path):
+    """
+    Reads the image name and emotion columns of a labels CSV file as two parallel lists, rather
+    than one tuple per row. Files without any quoting and no larger than MAX_IN_MEMORY_CSV_SIZE
+    are read at once and split directly; others go through stream_label_rows.
+    Both paths decode with the locale's preferred encoding, as open() does by default.
+    """
+    encoding = locale.getpreferredencoding(False)
+    if os.path.getsize(csv_path) <= MAX_IN_MEMORY_CSV_SIZE:
+        with open(csv_path, 'rb') as csvfile:
+            data = csvfile.read()
+        if b'"' not in data:
+            # splitlines handles \n, \r\n and bare \r line endings alike; [1:] skips the header row
+            rows = [line.split(b',', 3) for line in data.splitlines()[1:] if line]
+            image_names = [row[1].decode(encoding) for row in rows]
+            # Handle case sensitivity of the emotion labels in a single pass over the column
+            emotions = [row[2].decode(encoding).strip().lower() for row in rows]
+            return image_names, emotions
+    return stream_label_rows(csv_path, encoding)
+
 
 def read_labels(csv_path):
     """
     Reads the primary CSV file and creates a dictionary mapping emotion labels to image names.
+    Also returns the set of all image names, collected in the same pass.
     """
     emotion_images = defaultdict(set)
-    emotions_set = set()
-    with open(csv_path, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        next(reader)  # Skip header row if present
-        for row in reader:
-            image_name = row[1]
-            emotion = row[2].strip().lower()  # Handle case sensitivity
-            emotion_images[emotion].add(image_name)
-            emotions_set.add(emotion)
-    return emotion_images, emotions_set
+    all_image_names = set()
+    for image_name, emotion in zip(*read_label_rows(csv_path)):
+        emotion_images[emotion].add(image_name)
+        all_image_names.add(image_name)
+    emotions_set = set(emotion_images)
+    return emotion_images, emotions_set, all_image_names
 
 
 def read_secondary_labels(csv_path, valid_emotions, label_mapping, primary_image_names):
@@ -28,52 +86,189 @@ def read_secondary_labels(csv_path, valid_emotions, label_mapping, primary_image
     ensuring no duplicate images are included.
     """
     emotion_images = defaultdict(set)
-    with open(csv_path, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        next(reader)  # Skip header row if present
-        for row in reader:
-            image_name = row[1]
-            emotion = row[2].strip().lower()  # Handle case sensitivity
-            # Map emotion labels if necessary
-            emotion = label_mapping.get(emotion, emotion)
-            if emotion in valid_emotions:
-                if image_name not in primary_image_names:
-                    emotion_images[emotion].add(image_name)
+    for image_name, emotion in zip(*read_label_rows(csv_path)):
+        # Map emotion labels if necessary
+        emotion = label_mapping.get(emotion, emotion)
+        if emotion in valid_emotions and image_name not in primary_image_names:
+            emotion_images[emotion].add(image_name)
     return emotion_images
 
 
 def create_directories(output_dir, emotions, training_sizes):
     """
     Creates the train and test directories with subdirectories for each emotion label.
+    Directories left by a previous run are listed once and not created again.
     """
-    # Create test directory (same for all training conditions)
-    test_dir = os.path.join(output_dir, 'test')
-    for emotion in emotions:
-        emotion_dir = os.path.join(test_dir, emotion)
-        os.makedirs(emotion_dir, exist_ok=True)
+    # Test directory (same for all training conditions) and one training directory per training size
+    split_dirs = [os.path.join(output_dir, 'test')]
+    split_dirs.extend(os.path.join(output_dir, f'train_{size}') for size in training_sizes)
 
-    # Create training directories for each training size
-    for size in training_sizes:
-        train_dir = os.path.join(output_dir, f'train_{size}')
+    for split_dir in split_dirs:
+        if os.path.isdir(split_dir):
+            with os.scandir(split_dir) as entries:
+                existing_emotions = {entry.name for entry in entries if entry.is_dir()}
+        else:
+            os.makedirs(split_dir)
+            existing_emotions = set()
+        # Only emotions not listed above are created. makedirs with exist_ok keeps working for labels
+        # that are blank (the split directory itself) or contain a path separator
         for emotion in emotions:
-            emotion_dir = os.path.join(train_dir, emotion)
-            os.makedirs(emotion_dir, exist_ok=True)
+            if emotion not in existing_emotions:
+                os.makedirs(os.path.join(split_dir, emotion), exist_ok=True)
+
+
+def open_source(src_path, src_dir_fd=None, buffering=-1):
+    """
+    Opens src_path for binary reading. If src_dir_fd is given, src_path is resolved relative to
+    that directory descriptor instead of walking the full path again.
+    """
+    return open(src_path, 'rb', buffering=buffering,
+                opener=lambda path, flags: os.open(path, flags, dir_fd=src_dir_fd))
+
+
+def buffered_copy(src_path, dst_path, src_dir_fd=None):
+    """
+    Copies src_path to dst_path by reading into a reused 1 MiB buffer rather than allocating
+    a new chunk per read. Each thread gets its own buffer, so it is safe to use from the copy pool.
+    """
+    buffer = getattr(_copy_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _copy_buffers.buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+    with open_source(src_path, src_dir_fd, buffering=0) as src, open(dst_path, 'wb') as dst:
+        while n := src.readinto(buffer):
+            dst.write(buffer[:n])
+
+
+def kernel_copy(src_path, dst_path, src_dir_fd=None):
+    """
+    Copies src_path to dst_path with copy_file_range, so the data never leaves the kernel.
+    Falls back to buffered_copy where copy_file_range is unavailable (non-Linux, cross-device).
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open_source(src_path, src_dir_fd) as src, open(dst_path, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break  # Source got shorter while copying
+                    remaining -= copied
+            return
+        except OSError as e:
+            if e.errno not in COPY_FILE_RANGE_UNSUPPORTED:
+                raise
 
+    buffered_copy(src_path, dst_path, src_dir_fd)
 
-def organize_dataset(image_dir, primary_csv_path, secondary_csv_path, output_dir):
+
+def copy_mode(src_path, dst_path, src_dir_fd=None):
+    """
+    Gives dst_path the permission bits of src_path, like shutil.copymode, but with src_path
+    optionally relative to the directory descriptor src_dir_fd.
+    """
+    os.chmod(dst_path, stat.S_IMODE(os.stat(src_path, dir_fd=src_dir_fd).st_mode))
+
+
+def fast_copy(src_path, dst_path, link_mode='hardlink', src_dir_fd=None):
+    """
+    Places src_path at dst_path without copying data where possible: tries a hardlink, then a
+    reflink, then falls back to a regular copy. link_mode selects which step to start from.
+    If src_dir_fd is given, src_path is relative to that directory descriptor.
+    """
+    # Remove output left by a previous run, so writing to it can never truncate a linked source
+    try:
+        os.remove(dst_path)
+    except FileNotFoundError:
+        pass
+
+    if link_mode == 'hardlink':
+        try:
+            os.link(src_path, dst_path, src_dir_fd=src_dir_fd)
+            return
+        except OSError:
+            pass  # Cross-device or unsupported by the filesystem
+
+    if link_mode in ('hardlink', 'reflink') and fcntl is not None:
+        try:
+            with open_source(src_path, src_dir_fd) as src, open(dst_path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            copy_mode(src_path, dst_path, src_dir_fd)
+            return
+        except OSError:
+            pass  # Filesystem without copy-on-write support
+
+    kernel_copy(src_path, dst_path, src_dir_fd)
+    # New files get the default mode, so carry the permission bits over as shutil.copy did
+    copy_mode(src_path, dst_path, src_dir_fd)
+
+
+def copy_to_all(src_path, dst_paths, link_mode='hardlink', src_dir_fd=None):
+    """
+    Places src_path at every path in dst_paths while reading the source only once: it is copied
+    to the first destination, and the remaining destinations are filled from that copy.
+    """
+    first_dst_path = dst_paths[0]
+    fast_copy(src_path, first_dst_path, link_mode, src_dir_fd)
+    for dst_path in dst_paths[1:]:
+        fast_copy(first_dst_path, dst_path, link_mode)
+
+
+def copy_images(image_dir, plan, link_mode='hardlink', max_workers=None):
+    """
+    Copies images concurrently, since the work is I/O-bound. plan maps each image name in image_dir
+    to the list of its destination paths. max_workers bounds how many images are in flight at once.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+
+    # Open the image directory once and look images up relative to it, where the platform allows
+    src_dir_fd = None
+    if all(func in os.supports_dir_fd for func in (os.open, os.link, os.stat)):
+        src_dir_fd = os.open(image_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        if src_dir_fd is not None:
+            items = plan.items()
+        else:
+            # Join by concatenation; the prefix already ends in exactly one separator
+            image_dir_prefix = os.path.join(image_dir, '')
+            items = ((image_dir_prefix + image_name, dst_paths) for image_name, dst_paths in plan.items())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda item: copy_to_all(*item, link_mode=link_mode, src_dir_fd=src_dir_fd), items))
+    finally:
+        if src_dir_fd is not None:
+            os.close(src_dir_fd)
+
+
+def positive_int(value):
+    """
+    argparse type for options that need a whole number of at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def organize_dataset(image_dir, primary_csv_path, secondary_csv_path, output_dir, link_mode='hardlink',
+                     max_workers=None):
     """
     Organizes the dataset by copying images into multiple training sets with increasing sizes
     and a fixed test set. Uses the secondary CSV file to fill up images if necessary.
+    See fast_copy for how link_mode controls the way images are copied; max_workers sets the number
+    of concurrent copies.
     """
     # Define the training sizes
     training_sizes = [10, 20, 30, 40, 50]
 
+    # List the image directory once instead of checking every image path separately.
+    # Names missing from the listing are still checked with os.path.exists below.
+    with os.scandir(image_dir) as entries:
+        available_images = {entry.name for entry in entries}
+    image_dir_prefix = os.path.join(image_dir, '')
+
     # Read labels from the primary CSV file
-    primary_emotion_images, valid_emotions = read_labels(primary_csv_path)
-    # Keep track of all primary image names to avoid duplicates
-    primary_image_names = set()
-    for images in primary_emotion_images.values():
-        primary_image_names.update(images)
+    # Also keep track of all primary image names to avoid duplicates
+    primary_emotion_images, valid_emotions, primary_image_names = read_labels(primary_csv_path)
 
     # Read labels from the secondary CSV file, only for valid emotions
     secondary_emotion_images = defaultdict(set)
@@ -90,49 +285,58 @@ def organize_dataset(image_dir, primary_csv_path, secondary_csv_path, output_dir
 
     create_directories(output_dir, valid_emotions, training_sizes)
 
-    # Combine primary and secondary images per emotion
-    combined_emotion_images = {}
-    for emotion in valid_emotions:
-        images = set()
-        images.update(primary_emotion_images[emotion])
-        images.update(secondary_emotion_images.get(emotion, set()))
-        combined_emotion_images[emotion] = images
+    # Collect the destinations of every image up front so the copy pool stays saturated
+    plan = defaultdict(list)
+    # Largest training size first, so an image's first destination is in the largest training set
+    # it belongs to, and the smaller training sets are filled from there
+    training_sizes_desc = sorted(training_sizes, reverse=True)
+    # Missing images are reported together once all emotions are processed
+    missing_images = []
 
     # Process each emotion category
     for emotion in valid_emotions:
-        images = list(combined_emotion_images[emotion])
-        # Sort images to maintain consistent order
-        images.sort()
+        # Select the first 60 images in sorted order from primary and secondary images combined.
+        # The two never overlap, since secondary images already exclude the primary ones.
+        selected_images = heapq.nsmallest(
+            60, chain(primary_emotion_images[emotion], secondary_emotion_images.get(emotion, ())))
         # Ensure at least 60 images are available
-        if len(images) < 60:
-            print(f"Warning: Only {len(images)} images found for emotion '{emotion}'. Need at least 60.")
+        if len(selected_images) < 60:
+            print(f"Warning: Only {len(selected_images)} images found for emotion '{emotion}'. Need at least 60.")
             continue  # Skip this emotion if not enough images
-        # Select the first 60 images
-        selected_images = images[:60]
         # Split into training and test sets
         test_images = selected_images[-10:]  # Last 10 images for testing
         training_images_full = selected_images[:-10]  # First 50 images for training
 
-        # Copy test images
-        for image_name in test_images:
-            src_path = os.path.join(image_dir, image_name)
-            dst_path = os.path.join(output_dir, 'test', emotion, image_name)
-            if os.path.exists(src_path):
-                shutil.copy(src_path, dst_path)
-            else:
-                print(f"Warning: Image {image_name} not found in image directory.")
-
-        # Create training sets with increasing sizes
-        for size in training_sizes:
-            train_images = training_images_full[:size]  # Select the first 'size' images
-            train_dir = os.path.join(output_dir, f'train_{size}', emotion)
-            for image_name in train_images:
-                src_path = os.path.join(image_dir, image_name)
-                dst_path = os.path.join(train_dir, image_name)
-                if os.path.exists(src_path):
-                    shutil.copy(src_path, dst_path)
+        # Check each image once, however many training sets it belongs to. A name that is not in the
+        # listing can still exist on case-insensitive filesystems (NTFS, APFS), where 'Foo.JPG' finds
+        # 'foo.jpg', so only names that os.path.exists also rejects are missing
+        for image_name in selected_images:
+            if image_name not in available_images:
+                if os.path.exists(image_dir_prefix + image_name):
+                    available_images.add(image_name)
                 else:
-                    print(f"Warning: Image {image_name} not found in image directory.")
+                    missing_images.append(image_name)
+
+        # Test images. Directory prefixes end in a separator, so paths are joined by concatenation
+        test_dir_prefix = os.path.join(output_dir, 'test', emotion, '')
+        for image_name in test_images:
+            if image_name in available_images:
+                plan[image_name].append(test_dir_prefix + image_name)
+
+        # Training sets with increasing sizes: image i belongs to every set larger than i
+        train_dir_prefixes = [(size, os.path.join(output_dir, f'train_{size}', emotion, ''))
+                              for size in training_sizes_desc]
+        for i, image_name in enumerate(training_images_full):
+            if image_name in available_images:
+                plan[image_name].extend(
+                    train_dir_prefix + image_name for size, train_dir_prefix in train_dir_prefixes if i < size)
+
+    if missing_images:
+        shown = ', '.join(missing_images[:10])
+        more = f" and {len(missing_images) - 10} more" if len(missing_images) > 10 else ''
+        print(f"Warning: {len(missing_images)} images not found in image directory: {shown}{more}.")
+
+    copy_images(image_dir, plan, link_mode, max_workers)
 
     print("Dataset organized successfully.")
 
@@ -146,6 +350,11 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--secondary_csv', type=str, help='Path to your secondary CSV file containing labels.')
     parser.add_argument('-o', '--output_dir', type=str, required=True,
                         help='Path where you want the organized dataset.')
+    parser.add_argument('--link_mode', choices=LINK_MODES, default='hardlink',
+                        help='How images are placed in the dataset: hardlink (falls back to reflink, then copy), '
+                             'reflink (falls back to copy) or copy. Linked files share data with the originals.')
+    parser.add_argument('-w', '--workers', type=positive_int,
+                        help='Number of concurrent copies (default: min(32, 4 x CPU count)).')
 
     args = parser.parse_args()
 
@@ -153,5 +362,7 @@ if __name__ == '__main__':
         image_dir=args.image_dir,
         primary_csv_path=args.primary_csv,
         secondary_csv_path=args.secondary_csv,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        link_mode=args.link_mode,
+        max_workers=args.workers
     )